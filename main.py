@@ -1,7 +1,9 @@
 # main.py
 import asyncio
 import base64
-import json
+import binascii
+import logging
+import orjson
 import websockets
 import os
 from dotenv import load_dotenv
@@ -9,9 +11,18 @@ from tssdcl_sql import FUNCTION_MAP  # async functions map
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Agent Settings message, read once; config.json is already the JSON sent to STS
+with open("config.json", "rb") as f:
+    CONFIG_MESSAGE = f.read()
+
 # in-memory conversation buffer per streamSid
 conversation_buffers = {}  # streamSid -> {"user":[...], "assistant":[...]}
 
+# strong refs to fire-and-forget tasks; the event loop only keeps weak ones
+background_tasks = set()
+
 
 def sts_connect():
     api_key = os.getenv("DEEPGRAM_API_KEY")
@@ -25,15 +36,32 @@ def sts_connect():
     return sts_ws
 
 
-def load_config():
-    with open("config.json", "r") as f:
-        return json.load(f)
+def put_drop_oldest(queue, item):
+    """Enqueue without blocking; when full, discard the oldest item (stale audio is worthless)."""
+    try:
+        queue.put_nowait(item)
+    except asyncio.QueueFull:
+        queue.get_nowait()
+        queue.put_nowait(item)
+
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def finalize_call(streamsid):
+    """Per-call teardown, run off the receive loop once Twilio sends "stop"."""
+    # cleanup buffer to free memory (DB retains records)
+    conversation_buffers.pop(streamsid, None)
 
 
 async def handle_barge_in(decoded, twilio_ws, streamsid):
     if decoded.get("type") == "UserStartedSpeaking":
         clear_message = {"event": "clear", "streamSid": streamsid}
-        await twilio_ws.send(json.dumps(clear_message))
+        await twilio_ws.send(orjson.dumps(clear_message), text=True)
 
 
 async def execute_function_call(func_name, arguments):
@@ -42,96 +70,91 @@ async def execute_function_call(func_name, arguments):
     func = FUNCTION_MAP[func_name]
     try:
         result = await func(**arguments)
-        print(f"Function call result: {result}")
+        logger.debug("Function call result: %s", result)
         return result
     except Exception as e:
-        print(f"Error executing function {func_name}: {e}")
+        logger.error("Error executing function %s: %s", func_name, e)
         return {"error": f"Function execution failed: {str(e)}"}
 
 
+def format_lookup_complaint(result):
+    comp = result.get("complaint")
+    if comp is None:
+        return format_default(result)
+    complaint_no = comp.get("complaint_no", "N/A")
+    status = comp.get("status", "unknown")
+    created = comp.get("created_time")
+    content_str = f"Found complaint {complaint_no} with status: {status}. Created: {created[:10] if created else 'N/A'}"
+    estimation_time = comp.get("estimation_time")
+    if estimation_time:
+        content_str += f". Estimated resolution: {estimation_time}"
+    return content_str
+
+
+def format_raise_complaint(result):
+    complaint_id = result.get("complaint_id")
+    short_id = complaint_id[:8] + "..." if complaint_id else "N/A"
+    return f"Complaint registered successfully. Number: {result.get('complaint_no', 'N/A')}, ID: {short_id}"
+
+
+def format_default(result):
+    return str(result.get("message", "Function completed successfully"))
+
+
+# func_name -> concise FunctionCallResponse content for a successful result
+RESPONSE_FORMATTERS = {
+    "lookup_complaint": format_lookup_complaint,
+    "raise_complaint": format_raise_complaint,
+}
+
+
 def create_function_call_response(func_id, func_name, result):
     # For Deepgram Agent API, content should be a concise text summary or simple JSON
     # not a complex nested object
     if isinstance(result, dict):
         if result.get("error"):
             content_str = f"Error: {result['error']}"
-        elif func_name == "lookup_complaint" and "complaint" in result:
-            # Extract key info for a concise response
-            comp = result["complaint"]
-            status = comp.get("status", "unknown")
-            complaint_no = comp.get("complaint_no", "N/A")
-            complaint_id = comp.get("complaint_id", "N/A")
-            created = comp.get("created_time", "N/A")
-            estimation_time = comp.get("estimation_time")
-            
-            # Create a simple, concise response
-            content_str = f"Found complaint {complaint_no} with status: {status}. Created: {created[:10] if created != 'N/A' else 'N/A'}"
-            if estimation_time:
-                content_str += f". Estimated resolution: {estimation_time}"
-        elif func_name == "raise_complaint":
-            complaint_no = result.get("complaint_no", "N/A")
-            complaint_id = result.get("complaint_id", "N/A")[:8] + "..." if result.get("complaint_id") else "N/A"
-            content_str = f"Complaint registered successfully. Number: {complaint_no}, ID: {complaint_id}"
         else:
-            # Generic handling for other functions
-            content_str = str(result.get("message", "Function completed successfully"))
+            content_str = RESPONSE_FORMATTERS.get(func_name, format_default)(result)
     else:
         content_str = str(result)
-    
-    print("DEBUG: Creating FunctionCallResponse content:", content_str)
+
     return {"type": "FunctionCallResponse", "id": func_id, "name": func_name, "content": content_str}
 
 
-async def handle_function_call_request(decoded, sts_ws, streamsid, audio_lock: asyncio.Lock):
-    """
-    Handle function call requests from STS.
-    Acquire audio_lock while sending control messages to avoid interleaving with audio.
-    """
+async def run_function_call(function_call):
+    """Execute one requested function and build its FunctionCallResponse."""
+    func_name = function_call.get("name", "unknown")
+    func_id = function_call.get("id", "unknown")
     try:
-        for function_call in decoded.get("functions", []):
-            func_name = function_call["name"]
-            func_id = function_call["id"]
-            arguments = json.loads(function_call["arguments"])
+        arguments = orjson.loads(function_call["arguments"])
+        logger.info("Function call: %s (ID: %s), arguments: %s", func_name, func_id, arguments)
 
-            print(f"Function call: {func_name} (ID: {func_id}), arguments: {arguments}")
+        # Execute the function (DB ops)
+        result = await execute_function_call(func_name, arguments)
+    except Exception as e:
+        logger.error("Error calling function: %s", e)
+        result = {"error": f"Function call failed with: {str(e)}"}
+    return create_function_call_response(func_id, func_name, result)
 
-            # Execute the function (DB ops) outside lock
-            result = await execute_function_call(func_name, arguments)
 
-            # Acquire lock before any control send
-            await audio_lock.acquire()
-            try:
-                function_result = create_function_call_response(func_id, func_name, result)
-                fr_json = json.dumps(function_result)
-                print("DEBUG: function_result JSON (len={}): {}".format(len(fr_json), fr_json))
-                await sts_ws.send(fr_json)
-                print("Sent function result")
-
-                # small delay to help STS parsing
-                await asyncio.sleep(0.05)
-            finally:
-                # always release lock
-                audio_lock.release()
+async def handle_function_call_request(decoded, sts_out_queue, streamsid):
+    """
+    Handle function call requests from STS.
+    All requested functions run concurrently; responses are queued in request
+    order for sts_writer as str, so they go out as text frames.
+    """
+    function_results = await asyncio.gather(
+        *(run_function_call(function_call) for function_call in decoded.get("functions", []))
+    )
+    for function_result in function_results:
+        fr_json = orjson.dumps(function_result).decode()
+        await sts_out_queue.put(fr_json)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Queued function_result JSON (len=%d): %s", len(fr_json), fr_json)
 
-    except Exception as e:
-        print(f"Error calling function: {e}")
-        try:
-            # safe fallback - acquire lock and notify STS of the error
-            await audio_lock.acquire()
-            try:
-                await sts_ws.send(json.dumps(create_function_call_response(
-                    function_call.get("id", "unknown"),
-                    function_call.get("name", "unknown"),
-                    {"error": f"Function call failed with: {str(e)}"}
-                )))
-                await asyncio.sleep(0.03)
-            finally:
-                audio_lock.release()
-        except Exception:
-            pass
-
-
-async def handle_text_message(decoded, twilio_ws, sts_ws, streamsid, audio_lock: asyncio.Lock):
+
+async def handle_text_message(decoded, twilio_ws, sts_out_queue, streamsid):
     await handle_barge_in(decoded, twilio_ws, streamsid)
 
     # Capture all user/assistant texts into conversation buffer
@@ -148,53 +171,63 @@ async def handle_text_message(decoded, twilio_ws, sts_ws, streamsid, audio_lock:
         return
 
     if decoded.get("type") == "FunctionCallRequest":
-        await handle_function_call_request(decoded, sts_ws, streamsid, audio_lock)
+        await handle_function_call_request(decoded, sts_out_queue, streamsid)
 
 
-async def sts_sender(sts_ws, audio_queue, audio_lock: asyncio.Lock):
+async def sts_sender(audio_queue, sts_out_queue):
     """
-    Send raw audio chunks to STS, but hold audio_lock to ensure mutual exclusion with control frames.
+    Forward raw audio chunks from Twilio to the STS outbound queue.
     """
-    print("sts_sender started")
+    logger.info("sts_sender started")
     try:
         while True:
-            chunk = await audio_queue.get()
-            # Acquire lock before sending audio; this ensures no control frame is being sent concurrently
-            await audio_lock.acquire()
+            await sts_out_queue.put(await audio_queue.get())
+    except asyncio.CancelledError:
+        logger.info("sts_sender cancelled")
+    finally:
+        logger.info("sts_sender exiting")
+
+
+async def sts_writer(sts_ws, sts_out_queue):
+    """
+    Sole writer to the STS socket: audio (bytes) goes out as binary frames,
+    control messages (str) as text frames, in the order they were queued.
+    """
+    logger.info("sts_writer started")
+    try:
+        while True:
+            message = await sts_out_queue.get()
             try:
-                await sts_ws.send(chunk)
+                await sts_ws.send(message)
             except websockets.exceptions.ConnectionClosedOK:
-                print("sts_sender: STS connection closed (OK). Exiting sender loop.")
+                logger.info("sts_writer: STS connection closed (OK). Exiting writer loop.")
                 break
             except Exception as e:
-                print("sts_sender exception while sending media:", repr(e))
+                logger.warning("sts_writer exception while sending: %r", e)
                 break
-            finally:
-                audio_lock.release()
     except asyncio.CancelledError:
-        print("sts_sender cancelled")
+        logger.info("sts_writer cancelled")
     finally:
-        print("sts_sender exiting")
+        logger.info("sts_writer exiting")
 
 
-async def sts_receiver(sts_ws, twilio_ws, streamsid_queue, audio_lock: asyncio.Lock):
-    print("sts_receiver started")
+async def sts_receiver(sts_ws, twilio_ws, sts_out_queue, streamsid_queue):
+    logger.info("sts_receiver started")
     streamsid = await streamsid_queue.get()
+    # Only the payload varies per outbound audio frame, so the envelope is
+    # encoded once and the base64 blob spliced in.
+    media_prefix = b'{"event":"media","streamSid":' + orjson.dumps(streamsid) + b',"media":{"payload":"'
+    media_suffix = b'"}}'
 
     async for message in sts_ws:
         if isinstance(message, str):
-            print("STS Text:", message)
-            decoded = json.loads(message)
-            await handle_text_message(decoded, twilio_ws, sts_ws, streamsid, audio_lock)
+            logger.debug("STS Text: %s", message)
+            decoded = orjson.loads(message)
+            await handle_text_message(decoded, twilio_ws, sts_out_queue, streamsid)
             continue
 
         raw_mulaw = message
-        media_message = {
-            "event": "media",
-            "streamSid": streamsid,
-            "media": {"payload": base64.b64encode(raw_mulaw).decode("ascii")}
-        }
-        await twilio_ws.send(json.dumps(media_message))
+        await twilio_ws.send(media_prefix + base64.b64encode(raw_mulaw) + media_suffix, text=True)
 
 
 async def twilio_receiver(twilio_ws, audio_queue, streamsid_queue):
@@ -204,7 +237,7 @@ async def twilio_receiver(twilio_ws, audio_queue, streamsid_queue):
 
     async for message in twilio_ws:
         try:
-            data = json.loads(message)
+            data = orjson.loads(message)
             event = data.get("event")
 
             if event == "start":
@@ -212,43 +245,46 @@ async def twilio_receiver(twilio_ws, audio_queue, streamsid_queue):
                 streamsid = start.get("streamSid")
                 conversation_buffers.setdefault(streamsid, {"user": [], "assistant": []})
                 streamsid_queue.put_nowait(streamsid)
-                print("get our streamsid", streamsid)
+                logger.info("get our streamsid %s", streamsid)
             elif event == "connected":
                 continue
             elif event == "media":
                 media = data["media"]
-                chunk = base64.b64decode(media["payload"])
                 if media.get("track") == "inbound":
-                    inbuffer.extend(chunk)
+                    inbuffer.extend(binascii.a2b_base64(media["payload"]))
             elif event == "stop":
-                # cleanup buffer to free memory (DB retains records)
-                if streamsid and streamsid in conversation_buffers:
-                    del conversation_buffers[streamsid]
+                if streamsid:
+                    spawn_background(finalize_call(streamsid))
                 break
 
             while len(inbuffer) >= BUFFER_SIZE:
-                chunk = inbuffer[:BUFFER_SIZE]
-                audio_queue.put_nowait(chunk)
-                inbuffer = inbuffer[BUFFER_SIZE:]
+                put_drop_oldest(audio_queue, inbuffer[:BUFFER_SIZE])
+                # in-place; bytearray drops a prefix without copying the tail
+                del inbuffer[:BUFFER_SIZE]
         except Exception as e:
-            print("twilio_receiver exception:", e)
+            logger.error("twilio_receiver exception: %s", e)
             break
 
 
 async def twilio_handler(twilio_ws):
-    audio_queue = asyncio.Queue()
-    streamsid_queue = asyncio.Queue()
-    # Lock used to ensure control frames and audio frames don't interleave
-    audio_lock = asyncio.Lock()
+    # Everything bound for STS goes through this queue to a single writer. Kept
+    # at one entry so a stalled STS backs audio up into audio_queue, where the
+    # oldest chunks get dropped, and control messages never queue behind a
+    # long audio backlog.
+    sts_out_queue = asyncio.Queue(maxsize=1)
+    # Each chunk is 400ms of 8kHz mulaw. Counting the chunk sts_sender holds and
+    # the one in sts_out_queue, at most 5 chunks (~2s) are buffered for STS.
+    audio_queue = asyncio.Queue(maxsize=3)
+    streamsid_queue = asyncio.Queue(maxsize=1)
 
     async with sts_connect() as sts_ws:
-        config_message = load_config()
-        await sts_ws.send(json.dumps(config_message))
+        await sts_ws.send(CONFIG_MESSAGE, text=True)
 
         await asyncio.wait(
             [
-                asyncio.ensure_future(sts_sender(sts_ws, audio_queue, audio_lock)),
-                asyncio.ensure_future(sts_receiver(sts_ws, twilio_ws, streamsid_queue, audio_lock)),
+                asyncio.ensure_future(sts_sender(audio_queue, sts_out_queue)),
+                asyncio.ensure_future(sts_writer(sts_ws, sts_out_queue)),
+                asyncio.ensure_future(sts_receiver(sts_ws, twilio_ws, sts_out_queue, streamsid_queue)),
                 asyncio.ensure_future(twilio_receiver(twilio_ws, audio_queue, streamsid_queue)),
             ],
             return_when=asyncio.FIRST_COMPLETED
@@ -258,8 +294,12 @@ async def twilio_handler(twilio_ws):
 
 
 async def main():
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
     server = await websockets.serve(twilio_handler, "0.0.0.0", 5000)
-    print("Started server on 0.0.0.0:5000")
+    logger.info("Started server on 0.0.0.0:5000")
     try:
         await asyncio.Future()
     finally:
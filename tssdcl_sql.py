@@ -2,8 +2,13 @@
 import os
 import uuid
 import datetime
+import queue
+import time
 import pyodbc
 import asyncio
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,12 +19,14 @@ load_dotenv()
 # SQL_USER
 # SQL_PASSWORD
 # ODBC_DRIVER (optional; default "ODBC Driver 18 for SQL Server")
+# SQL_POOL_SIZE (optional; default 8 pooled connections)
 
 SQL_SERVER = os.getenv("SQL_SERVER")
 SQL_DATABASE = os.getenv("SQL_DATABASE", "TSSPDCL_SQL_DB")
 SQL_USER = os.getenv("SQL_USER")
 SQL_PASSWORD = os.getenv("SQL_PASSWORD")
 ODBC_DRIVER = os.getenv("ODBC_DRIVER", "ODBC Driver 18 for SQL Server")
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "8"))
 
 if not (SQL_SERVER and SQL_USER and SQL_PASSWORD):
     # Delay hard failure — functions will still raise if used without env set.
@@ -34,166 +41,280 @@ CONN_STR = (
     "Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
 )
 
+# Idle connections kept alive between calls, so each function call skips the
+# TLS handshake + login round-trips to Azure SQL. Filled lazily.
+_POOL = queue.LifoQueue(maxsize=SQL_POOL_SIZE)
+
+# DB calls get their own threads, one per pooled connection: they never queue
+# behind other to_thread work in the default executor, and concurrent calls
+# never outnumber the pool.
+_EXECUTOR = ThreadPoolExecutor(max_workers=SQL_POOL_SIZE, thread_name_prefix="tssdcl-sql")
+
 def _get_conn():
     """Return a new pyodbc connection. Caller must close it."""
     return pyodbc.connect(CONN_STR)
 
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except pyodbc.Error:
+        pass
+
+@contextmanager
+def _checkout():
+    """Borrow a live connection from the pool, returning it when the block exits.
+
+    Pooled connections are validated with a cheap `SELECT 1`; a dead one is
+    discarded and replaced. On return the connection is rolled back, so no
+    implicit transaction (autocommit is off) leaks into the next borrower. A
+    connection whose block raised, or that fails to roll back, is closed
+    rather than pooled, since its state is unknown.
+    """
+    conn = None
+    try:
+        conn = _POOL.get_nowait()
+        conn.execute("SELECT 1").close()
+    except queue.Empty:
+        pass
+    except pyodbc.Error:
+        _close_quietly(conn)
+        conn = None
+    if conn is None:
+        conn = _get_conn()
+
+    try:
+        yield conn
+    except BaseException:
+        _close_quietly(conn)
+        raise
+    try:
+        conn.rollback()
+    except pyodbc.Error:
+        _close_quietly(conn)
+        return
+    try:
+        _POOL.put_nowait(conn)
+    except queue.Full:
+        _close_quietly(conn)
+
+# ------------- SQL statements (built once at import) -------------
+
+# Use OUTPUT to return the auto-increment complaint_no
+_INSERT_COMPLAINT_SQL = """
+INSERT INTO dbo.complaints
+    (id, service_no, name, area_description, landmark, problem_details, status, created_time)
+OUTPUT INSERTED.complaint_no
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Parameter types for the complaints INSERT, matching the table schema, so
+# pyodbc binds directly instead of inferring types from each Python value.
+_RAISE_COMPLAINT_INPUT_SIZES = [
+    (pyodbc.SQL_WVARCHAR, 36, 0),        # id
+    (pyodbc.SQL_WVARCHAR, 50, 0),        # service_no
+    (pyodbc.SQL_WVARCHAR, 100, 0),       # name
+    (pyodbc.SQL_WVARCHAR, 255, 0),       # area_description
+    (pyodbc.SQL_WVARCHAR, 255, 0),       # landmark
+    (pyodbc.SQL_WVARCHAR, 0, 0),         # problem_details, NVARCHAR(MAX)
+    (pyodbc.SQL_WVARCHAR, 50, 0),        # status
+    (pyodbc.SQL_TYPE_TIMESTAMP, 27, 7),  # created_time, DATETIME2
+]
+
+# Result keys for one SELECT list, plus its query per way of identifying the complaint
+_LookupStatements = namedtuple("_LookupStatements", ["keys", "by_no", "by_id", "by_prefix"])
+
+def _lookup_statements(columns, keys):
+    return _LookupStatements(
+        keys=keys,
+        by_no=f"""
+        SELECT {columns}
+        FROM dbo.complaints
+        WHERE complaint_no = ?
+        """,
+        by_id=f"""
+        SELECT {columns}
+        FROM dbo.complaints
+        WHERE id = ?
+        """,
+        # the prefix is a range seek on the unique index on id; TOP 1 turns the
+        # full sort of the matches into a TOP-N sort that keeps only the newest
+        by_prefix=f"""
+        SELECT TOP 1 {columns}
+        FROM dbo.complaints
+        WHERE id LIKE ?
+        ORDER BY created_time DESC
+        """,
+    )
+
+# The voice turn only reads the summary fields; the full row carries the wide
+# free-text columns.
+_LOOKUP_SUMMARY_SQL = _lookup_statements(
+    "complaint_no, id, status, estimation_time, created_time",
+    ["complaint_no", "complaint_id", "status", "estimation_time", "created_time"],
+)
+_LOOKUP_FULL_SQL = _lookup_statements(
+    """complaint_no, id, service_no, name, area_description, landmark,
+           problem_details, status, estimation_time, created_time,
+           resolved_time, resolution_duration""",
+    ["complaint_no", "complaint_id", "service_no", "name", "area_description", "landmark",
+     "problem_details", "status", "estimation_time", "created_time",
+     "resolved_time", "resolution_duration"],
+)
+
+# Single round-trip: resolved_time / resolution_duration are computed
+# server-side from the stored created_time.
+_UPDATE_COMPLAINT_STATUS_SQL = """
+UPDATE dbo.complaints
+SET status = ?,
+    estimation_time = ?,
+    resolved_time = CASE WHEN ? = 'fault rectified' THEN SYSUTCDATETIME() ELSE NULL END,
+    resolution_duration = CASE WHEN ? = 'fault rectified'
+        THEN CAST(DATEDIFF(SECOND, created_time, SYSUTCDATETIME()) AS nvarchar(50))
+        ELSE NULL END
+OUTPUT INSERTED.resolved_time, INSERTED.resolution_duration
+WHERE id = ?
+"""
+
 # ------------- Blocking DB helpers (run in thread) -------------
 def _raise_complaint_blocking(service_no, name, area_description, landmark, problem_details):
-    conn = _get_conn()
-    cur = conn.cursor()
     complaint_id = str(uuid.uuid4())
-    created_time = datetime.datetime.utcnow()
-    try:
-        # Use OUTPUT to return the auto-increment complaint_no
-        q = """
-        INSERT INTO dbo.complaints
-            (id, service_no, name, area_description, landmark, problem_details, status, created_time)
-        OUTPUT INSERTED.complaint_no
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        cur.execute(q,
-                    complaint_id,
-                    service_no,
-                    name,
-                    area_description,
-                    landmark,
-                    problem_details,
-                    'patrolling',
-                    created_time)
+    created_time = datetime.datetime.now(datetime.timezone.utc)
+    with _checkout() as conn, closing(conn.cursor()) as cur:
+        cur.setinputsizes(_RAISE_COMPLAINT_INPUT_SIZES)
+        cur.execute(_INSERT_COMPLAINT_SQL, (complaint_id,
+                                            service_no,
+                                            name,
+                                            area_description,
+                                            landmark,
+                                            problem_details,
+                                            'patrolling',
+                                            created_time.replace(tzinfo=None)))  # DATETIME2 holds naive UTC
         inserted = cur.fetchone()  # should contain the complaint_no
         conn.commit()
         complaint_no = inserted[0] if inserted else None
-    finally:
-        try:
-            cur.close()
-        except:
-            pass
-        conn.close()
 
     return {
         "message": "Complaint registered successfully",
         "complaint_id": complaint_id,
         "complaint_no": complaint_no,
         "status": "patrolling",
-        "created_time": created_time.isoformat() + "Z"
+        "created_time": created_time.isoformat()
     }
 
-def _lookup_complaint_blocking(complaint_no=None, complaint_id=None):
-    conn = _get_conn()
-    cur = conn.cursor()
-    try:
+def _lookup_complaint_blocking(complaint_no=None, complaint_id=None, verbose=False):
+    sql = _LOOKUP_FULL_SQL if verbose else _LOOKUP_SUMMARY_SQL
+    with _checkout() as conn, closing(conn.cursor()) as cur:
         if complaint_no is not None:
-            q = """
-            SELECT complaint_no, id, service_no, name, area_description, landmark,
-                   problem_details, status, estimation_time, created_time,
-                   resolved_time, resolution_duration
-            FROM dbo.complaints
-            WHERE complaint_no = ?
-            """
-            cur.execute(q, complaint_no)
+            cur.execute(sql.by_no, (complaint_no,))
         elif complaint_id:
             # if full-length (36 chars) treat as exact match, else do prefix match via LIKE
             if len(complaint_id) == 36:
-                q = """
-                SELECT complaint_no, id, service_no, name, area_description, landmark,
-                       problem_details, status, estimation_time, created_time,
-                       resolved_time, resolution_duration
-                FROM dbo.complaints
-                WHERE id = ?
-                """
-                cur.execute(q, complaint_id)
+                cur.execute(sql.by_id, (complaint_id,))
             else:
-                q = """
-                SELECT complaint_no, id, service_no, name, area_description, landmark,
-                       problem_details, status, estimation_time, created_time,
-                       resolved_time, resolution_duration
-                FROM dbo.complaints
-                WHERE id LIKE ?
-                ORDER BY created_time DESC
-                """
-                cur.execute(q, complaint_id + "%")
+                cur.execute(sql.by_prefix, (complaint_id + "%",))
         else:
             return {"error": "Provide complaint_no or complaint_id"}
 
         row = cur.fetchone()
-        if not row:
-            return {"error": "Complaint not found"}
-
-        # Map row -> dict
-        keys = ["complaint_no", "complaint_id", "service_no", "name", "area_description", "landmark",
-                "problem_details", "status", "estimation_time", "created_time",
-                "resolved_time", "resolution_duration"]
-        values = list(row)
-        data = dict(zip(keys, values))
-        # convert datetimes to ISO strings
-        for k in ("created_time", "resolved_time"):
-            if data.get(k) is not None:
-                try:
-                    data[k] = data[k].isoformat() + "Z"
-                except Exception:
-                    data[k] = str(data[k])
-        return {"complaint": data}
-    finally:
-        try:
-            cur.close()
-        except:
-            pass
-        conn.close()
 
-def _update_complaint_status_blocking(complaint_id, status, estimation_time=None):
-    conn = _get_conn()
-    cur = conn.cursor()
-    try:
-        # Fetch existing created_time
-        cur.execute("SELECT created_time FROM dbo.complaints WHERE id = ?", complaint_id)
-        row = cur.fetchone()
-        if not row:
-            return {"error": "Complaint not found"}
-
-        created_time = row[0]
-        resolved_time = None
-        resolution_duration = None
-        if status == "fault rectified":
-            resolved_time = datetime.datetime.utcnow()
+    if not row:
+        return {"error": "Complaint not found"}
+
+    # Map row -> dict
+    values = list(row)
+    data = dict(zip(sql.keys, values))
+    # convert datetimes (stored as naive UTC) to ISO strings
+    for k in ("created_time", "resolved_time"):
+        if data.get(k) is not None:
             try:
-                duration = resolved_time - created_time
-                resolution_duration = str(duration)
+                data[k] = data[k].replace(tzinfo=datetime.timezone.utc).isoformat()
             except Exception:
-                resolution_duration = None
+                data[k] = str(data[k])
+    return {"complaint": data}
 
-        # Update
-        q = """
-        UPDATE dbo.complaints
-        SET status = ?, estimation_time = ?, resolved_time = ?, resolution_duration = ?
-        WHERE id = ?
-        """
-        cur.execute(q, status, estimation_time, resolved_time, resolution_duration, complaint_id)
+def _update_complaint_status_blocking(complaint_id, status, estimation_time=None):
+    with _checkout() as conn, closing(conn.cursor()) as cur:
+        cur.execute(_UPDATE_COMPLAINT_STATUS_SQL, (status, estimation_time, status, status, complaint_id))
+        row = cur.fetchone()
         conn.commit()
-        return {"message": "Complaint status updated", "complaint_id": complaint_id, "status": status}
-    finally:
-        try:
-            cur.close()
-        except:
-            pass
-        conn.close()
+
+    if not row:
+        return {"error": "Complaint not found"}
+    return {"message": "Complaint status updated", "complaint_id": complaint_id, "status": status}
+
+# ------------- Lookup cache -------------
+# Callers often re-ask for the same complaint within a conversation, and status
+# rarely changes within one agent turn. Hits are served on the event loop with
+# no thread hop or DB round-trip. Only touched from coroutines, so no locking.
+LOOKUP_CACHE_TTL = 30.0  # seconds
+_LOOKUP_CACHE_MAX = 1024
+_lookup_cache = OrderedDict()  # (complaint_no, complaint_id) -> (expires_at, result)
+# Bumped around every status update; a lookup that overlapped one does not cache
+# its (possibly pre-update) row.
+_lookup_generation = 0
+
+def _lookup_cache_get(key):
+    entry = _lookup_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, result = entry
+    if expires_at < time.monotonic():
+        del _lookup_cache[key]
+        return None
+    return result
+
+def _lookup_cache_put(key, result):
+    _lookup_cache[key] = (time.monotonic() + LOOKUP_CACHE_TTL, result)
+    _lookup_cache.move_to_end(key)
+    # entries share one TTL, so the oldest insert is also the first to expire
+    if len(_lookup_cache) > _LOOKUP_CACHE_MAX:
+        _lookup_cache.popitem(last=False)
+
+def _lookup_cache_invalidate(complaint_id):
+    stale = [key for key, (_, result) in _lookup_cache.items()
+             if result["complaint"]["complaint_id"] == complaint_id]
+    for key in stale:
+        del _lookup_cache[key]
 
 # ------------- Async wrappers (safe to call from your async main) -------------
+async def _run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, func, *args)
+
 async def raise_complaint(service_no=None, name=None, area_description=None, landmark=None, problem_details=None):
     if not name or not problem_details:
         return {"error": "Missing required fields: name and problem_details"}
-    return await asyncio.to_thread(_raise_complaint_blocking, service_no, name, area_description, landmark, problem_details)
+    return await _run_blocking(_raise_complaint_blocking, service_no, name, area_description, landmark, problem_details)
 
-async def lookup_complaint(complaint_no: int = None, complaint_id: str = None):
-    # Accept either complaint_no (int) or complaint_id (string/prefix)
+async def lookup_complaint(complaint_no: int = None, complaint_id: str = None, verbose: bool = False):
+    # Accept either complaint_no (int) or complaint_id (string/prefix).
+    # Returns the summary fields used by the voice agent unless verbose=True.
     if complaint_no is None and not complaint_id:
         return {"error": "Provide complaint_no or complaint_id"}
-    return await asyncio.to_thread(_lookup_complaint_blocking, complaint_no, complaint_id)
+    if verbose:
+        return await _run_blocking(_lookup_complaint_blocking, complaint_no, complaint_id, verbose)
+
+    key = (complaint_no, complaint_id)
+    cached = _lookup_cache_get(key)
+    if cached is not None:
+        return cached
+    generation = _lookup_generation
+    result = await _run_blocking(_lookup_complaint_blocking, complaint_no, complaint_id)
+    if "complaint" in result and generation == _lookup_generation:
+        _lookup_cache_put(key, result)
+    return result
 
 async def update_complaint_status(complaint_id: str, status: str, estimation_time: str = None):
     if not complaint_id or not status:
         return {"error": "Missing complaint_id or status"}
-    return await asyncio.to_thread(_update_complaint_status_blocking, complaint_id, status, estimation_time)
+    global _lookup_generation
+    # Bump on both sides: lookups already in flight, and ones started while the
+    # UPDATE runs, may both have read the old row.
+    _lookup_generation += 1
+    try:
+        return await _run_blocking(_update_complaint_status_blocking, complaint_id, status, estimation_time)
+    finally:
+        _lookup_generation += 1
+        _lookup_cache_invalidate(complaint_id)
 
 # ------------- Function map used by main.py -------------
 FUNCTION_MAP = {